@@ -1,12 +1,23 @@
 #!/usr/bin/env python3
 # app.py — robust webhook receiver with Telegram forwarding + logging
 
+# Must run before requests/urllib3 are imported so their sockets cooperate
+# with the gevent worker (see gunicorn.conf.py)
+from gevent import monkey
+monkey.patch_all()
+
+import atexit
+import hmac
 import os
-import json
 import logging
-import time
+import queue
+import threading
+from collections import Counter, namedtuple
+import orjson
 import requests
-from flask import Flask, request, jsonify
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Flask, request, Response
 
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s:%(message)s")
@@ -14,126 +25,269 @@ logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s:%(message
 # Secrets paths
 TOKEN_FILE = "/etc/webhook-secret/webhook_bearer"
 EXPECTED_TOKEN = None
+EXPECTED_AUTH_BYTES = None
 if os.path.exists(TOKEN_FILE):
-    with open(TOKEN_FILE, "r") as f:
+    # keep the secret as bytes end to end so no request ever re-encodes it
+    with open(TOKEN_FILE, "rb") as f:
         EXPECTED_TOKEN = f.read().strip()
-        app.logger.info("Loaded bearer token from %s (len=%d)", TOKEN_FILE, len(EXPECTED_TOKEN or ""))
+        # precomputed full header value for a single constant-time compare
+        EXPECTED_AUTH_BYTES = b"Bearer " + EXPECTED_TOKEN
+        app.logger.info("Loaded bearer token from %s (len=%d)", TOKEN_FILE, len(EXPECTED_TOKEN))
 
 # Telegram config from env (mounted from k8s Secret via env)
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID")
 
-def try_parse_json_string(s):
+# hard ceiling on per-request work so an alert storm cannot allocate
+# unbounded dicts or flood the Telegram queue from a single POST
+MAX_ALERTS = int(os.environ.get("MAX_ALERTS", "500"))
+TELEGRAM_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+
+# Shared session so the keep-alive connection to api.telegram.org is reused
+# across alerts instead of paying a TCP+TLS handshake per message.
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=16,
+        # allowed_methods must include POST explicitly (urllib3 skips it by
+        # default); 429 is retried honoring Telegram's Retry-After header
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["POST"]),
+            respect_retry_after_header=True,
+        ),
+    ),
+)
+
+# connect timeout 3.05s (slightly above the TCP retransmission window),
+# read timeout 10s
+TELEGRAM_TIMEOUT = (3.05, 10)
+
+def _json_response(obj, status=200):
+    # orjson.dumps is much faster than Flask's jsonify/json encoder
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+def try_parse_json_string(s, _loads=orjson.loads):
     try:
-        return json.loads(s)
-    except Exception:
+        return _loads(s)
+    except orjson.JSONDecodeError:
         return None
 
-def send_telegram(text, max_retries=3):
-    """Send message to Telegram, with retry and rich logging. Returns (ok, resp_json_or_text)."""
+def send_telegram(text):
+    """Send message to Telegram via the shared session. Returns (ok, resp_json_or_text).
+
+    Retries/backoff for 5xx are handled by the urllib3 Retry mounted on SESSION.
+    """
     if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
         app.logger.warning("Telegram credentials not configured (TELEGRAM_BOT_TOKEN/CHAT_ID missing). Skipping send.")
         return False, "no-creds"
 
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
     payload = {"chat_id": TELEGRAM_CHAT_ID, "text": text}
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    for attempt in range(1, max_retries + 1):
+    try:
+        r = SESSION.post(TELEGRAM_URL, data=payload, timeout=TELEGRAM_TIMEOUT)
+        app.logger.info("Telegram POST -> status=%s, text=%s", r.status_code, r.text[:200])
+        if r.status_code == 200:
+            try:
+                j = r.json()
+                return j.get("ok", False), j
+            except Exception:
+                return False, r.text
+        return False, r.text
+    except requests.exceptions.RequestException:
+        app.logger.exception("Network error sending to Telegram")
+        return False, "network_error"
+
+# Telegram caps messages at 4096 chars; leave headroom for joins.
+TELEGRAM_MAX_CHARS = 4000
+
+def send_telegram_batched(messages):
+    """Join messages into as few Telegram sends as possible.
+
+    Lines are grouped greedily into chunks of at most TELEGRAM_MAX_CHARS,
+    never splitting an individual message. Returns (ok, last_resp) where ok
+    is True only if every chunk was delivered.
+    """
+    if not messages:
+        return True, "empty"
+
+    all_ok = True
+    last_resp = None
+    chunk = []
+    chunk_len = 0
+    for msg in messages:
+        # +1 for the joining newline
+        if chunk and chunk_len + 1 + len(msg) > TELEGRAM_MAX_CHARS:
+            ok, last_resp = send_telegram("\n".join(chunk))
+            all_ok = all_ok and ok
+            chunk = []
+            chunk_len = 0
+        chunk.append(msg)
+        chunk_len += len(msg) + (1 if chunk_len else 0)
+    if chunk:
+        ok, last_resp = send_telegram("\n".join(chunk))
+        all_ok = all_ok and ok
+    return all_ok, last_resp
+
+# Background delivery: the /alert handler only enqueues; a daemon thread
+# drains the queue and talks to Telegram, so workers never block on its RTT.
+TG_QUEUE = queue.Queue(maxsize=10_000)
+DROPPED = 0
+
+# compact per-alert record passed through the queue; formatted into the
+# Telegram message lazily in the worker
+Alert = namedtuple("Alert", "status name instance summary")
+
+# counts payloads that miss the Alertmanager fast path in alert(); if this
+# stays at zero in production the generic shape sniffer can be retired
+SHAPE_SLOW_PATH = Counter()
+
+def _tg_worker():
+    while True:
+        batch = [TG_QUEUE.get()]
+        # drain whatever else is already queued so bursts still batch
+        while True:
+            try:
+                batch.append(TG_QUEUE.get_nowait())
+            except queue.Empty:
+                break
         try:
-            r = requests.post(url, data=payload, timeout=10)
-            app.logger.info("Telegram POST attempt %d -> status=%s, text=%s", attempt, r.status_code, r.text[:200])
-            if r.status_code == 200:
-                try:
-                    j = r.json()
-                    return j.get("ok", False), j
-                except Exception:
-                    return False, r.text
+            ok, resp = send_telegram_batched(["[%s] %s on %s — %s" % a for a in batch])
+            if ok:
+                app.logger.info("Forwarded %d alert(s) to Telegram: ok", len(batch))
             else:
-                # maybe retry for 5xx
-                if 500 <= r.status_code < 600:
-                    app.logger.warning("Server error from Telegram (%d). Retrying after backoff.", r.status_code)
-                    time.sleep(2 ** attempt)
-                    continue
-                return False, r.text
-        except requests.exceptions.RequestException as e:
-            app.logger.exception("Network error sending to Telegram on attempt %d", attempt)
-            time.sleep(1 * attempt)
-    return False, "max_retries_exceeded"
+                app.logger.warning("Failed to forward batch to Telegram: %s", resp)
+        except Exception:
+            app.logger.exception("Unexpected error in Telegram worker")
+        finally:
+            for _ in batch:
+                TG_QUEUE.task_done()
+
+def _warm_session():
+    # prime the keep-alive pool so the first real alert doesn't pay the
+    # DNS + TCP + TLS handshake; the getMe result itself is irrelevant
+    try:
+        SESSION.get(f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getMe", timeout=5)
+    except requests.exceptions.RequestException:
+        pass
+
+threading.Thread(target=_tg_worker, name="tg-worker", daemon=True).start()
+atexit.register(TG_QUEUE.join)
+if TELEGRAM_BOT_TOKEN:
+    threading.Thread(target=_warm_session, name="tg-warmup", daemon=True).start()
 
 @app.route("/alert", methods=["POST"])
 def alert():
-    # log headers & raw body
-    headers = {k: v for k, v in request.headers.items() if k in ("Content-Type", "User-Agent", "Authorization")}
-    app.logger.info("Headers: %s", headers)
-    raw = request.get_data(as_text=True)
-    app.logger.info("Raw body length=%d. first 2000 chars: %s", len(raw), raw[:2000])
-
-    # auth
-    if EXPECTED_TOKEN:
-        auth = request.headers.get("Authorization", "")
-        if not auth.startswith("Bearer ") or auth.split(" ", 1)[1] != EXPECTED_TOKEN:
-            app.logger.warning("Unauthorized request (bad token). header=%s", auth)
-            return jsonify({"error": "unauthorized"}), 401
-
-    # try parse
-    alerts_obj = request.get_json(silent=True)
-    if alerts_obj is None:
-        try:
-            alerts_obj = json.loads(raw)
-        except Exception:
-            alerts_obj = None
+    # auth first: unauthenticated traffic shouldn't cost a body read/parse.
+    # One constant-time memcmp against the precomputed header value — no
+    # startswith/split/slice allocations per request.
+    if EXPECTED_AUTH_BYTES is not None and not hmac.compare_digest(
+        request.headers.get("Authorization", "").encode(), EXPECTED_AUTH_BYTES
+    ):
+        app.logger.warning("Unauthorized request (bad token)")
+        return _json_response({"error": "unauthorized"}, 401)
+
+    # read the body once as bytes
+    raw = request.get_data(cache=True)
 
-    if isinstance(alerts_obj, dict) and "alerts" in alerts_obj and isinstance(alerts_obj["alerts"], list):
+    # header/body dumps are DEBUG-only: formatting 2000 chars per request
+    # at INFO dominates CPU and log volume under load
+    if app.logger.isEnabledFor(logging.DEBUG):
+        app.logger.debug(
+            "Hdrs: ct=%s ua=%s auth=%s",
+            request.headers.get("Content-Type"),
+            request.headers.get("User-Agent"),
+            "<redacted>" if request.headers.get("Authorization") else None,
+        )
+        app.logger.debug("Raw body length=%d. first 2000 chars: %s", len(raw), raw[:2000].decode("utf-8", "replace"))
+
+    # parse once, Content-Type agnostic (Alertmanager always sends JSON)
+    try:
+        alerts_obj = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        alerts_obj = None
+
+    # fast path: the Alertmanager v4 envelope {"alerts": [...], ...} covers
+    # ~all production traffic; the generic shape sniffer is the rare tail
+    if type(alerts_obj) is dict and type(alerts_obj.get("alerts")) is list:
         alerts_list = alerts_obj["alerts"]
-    elif isinstance(alerts_obj, list):
-        alerts_list = alerts_obj
-    elif isinstance(alerts_obj, dict):
-        alerts_list = [alerts_obj]
     else:
-        return jsonify({"error": "invalid_json"}), 400
+        SHAPE_SLOW_PATH["hits"] += 1
+        # a string body may itself be JSON (double-encoded array or object)
+        if type(alerts_obj) is str:
+            alerts_obj = try_parse_json_string(alerts_obj)
+            if type(alerts_obj) is dict and type(alerts_obj.get("alerts")) is list:
+                alerts_obj = alerts_obj["alerts"]
+        if type(alerts_obj) is list:
+            alerts_list = alerts_obj
+        elif type(alerts_obj) is dict:
+            alerts_list = [alerts_obj]
+        else:
+            return _json_response({"error": "invalid_json"}, 400)
+
+    received = len(alerts_list)
+    truncated = 0
+    if received > MAX_ALERTS:
+        truncated = received - MAX_ALERTS
+        app.logger.warning("Truncating alert list %d -> %d", received, MAX_ALERTS)
+        alerts_list = alerts_list[:MAX_ALERTS]
 
     processed = 0
     skipped = 0
     errors = []
 
+    # pre-bind hot attribute lookups so the per-alert loop stays on LOAD_FAST
+    _info = app.logger.info
+    _warn = app.logger.warning
+    _enqueue = TG_QUEUE.put_nowait
+
     for idx, a in enumerate(alerts_list):
-        if isinstance(a, str):
+        if type(a) is str:
             parsed = try_parse_json_string(a)
-            if isinstance(parsed, dict):
+            if type(parsed) is dict:
                 a = parsed
             else:
-                app.logger.warning("Skipping element #%d: string not parseable", idx)
+                _warn("Skipping element #%d: string not parseable", idx)
                 skipped += 1
                 continue
 
-        if not isinstance(a, dict):
+        if type(a) is not dict:
             skipped += 1
             continue
 
         try:
-            labels = a.get("labels", {}) if isinstance(a.get("labels", {}), dict) else {}
-            ann = a.get("annotations", {}) if isinstance(a.get("annotations", {}), dict) else {}
+            # single lookup + exact type check per field (hot per-alert path)
+            labels = a.get("labels")
+            if type(labels) is not dict:
+                labels = {}
+            ann = a.get("annotations")
+            if type(ann) is not dict:
+                ann = {}
             name = labels.get("alertname", "<no-name>")
             instance = labels.get("instance", labels.get("host", "<unknown>"))
             summary = ann.get("summary") or ann.get("description") or ""
             status = a.get("status", "?")
-            human = f"[{status}] {name} on {instance} — {summary}"
-            app.logger.info("ALERT normalized: %s", human)
-
-            # Forward to Telegram (synchronous)
-            ok, resp = send_telegram(human)
-            if ok:
-                app.logger.info("Forwarded to Telegram: ok")
-            else:
-                app.logger.warning("Failed to forward to Telegram: %s", resp)
+            # %-style so logging can skip formatting when INFO is filtered
+            _info("ALERT normalized: [%s] %s on %s — %s", status, name, instance, summary)
 
+            try:
+                _enqueue(Alert(status, name, instance, summary))
+            except queue.Full:
+                global DROPPED
+                DROPPED += 1
+                _warn("Telegram queue full; dropping alert (total dropped=%d)", DROPPED)
             processed += 1
         except Exception as e:
             app.logger.exception("Error processing element #%d", idx)
             errors.append(str(e))
             skipped += 1
 
-    return jsonify({"received_raw_count": len(alerts_list), "processed": processed, "skipped": skipped, "errors": errors}), 200
+    return _json_response(
+        {"received_raw_count": received, "processed": processed, "skipped": skipped, "truncated": truncated, "errors": errors}
+    )
 
 if __name__ == "__main__":
     port = int(os.environ.get("SERVER_PORT", os.environ.get("PORT", 8080)))
@@ -0,0 +1,10 @@
+# gunicorn.conf.py — run with: gunicorn -c gunicorn.conf.py app:app
+#
+# The hot path is outbound HTTPS to Telegram, so gevent greenlets let many
+# in-flight alerts wait on the network concurrently within each worker.
+import multiprocessing
+
+bind = "0.0.0.0:8080"
+worker_class = "gevent"
+workers = multiprocessing.cpu_count() * 2 + 1
+worker_connections = 1000
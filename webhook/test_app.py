@@ -0,0 +1,92 @@
+# test_app.py — pins the /alert shape-normalization matrix so the parse
+# logic doesn't drift again. Run with: python -m pytest webhook/
+import json
+
+import pytest
+
+import app as webhook_app
+
+
+@pytest.fixture
+def client():
+    webhook_app.app.config["TESTING"] = True
+    with webhook_app.app.test_client() as c:
+        yield c
+
+
+ALERT = {
+    "status": "firing",
+    "labels": {"alertname": "HighCPU", "instance": "node1"},
+    "annotations": {"summary": "CPU above 90%"},
+}
+
+
+def post(client, body):
+    return client.post("/alert", data=body, content_type="application/json")
+
+
+def test_alertmanager_envelope(client):
+    r = post(client, json.dumps({"alerts": [ALERT, ALERT]}))
+    assert r.status_code == 200
+    assert r.get_json()["processed"] == 2
+
+
+def test_bare_list(client):
+    r = post(client, json.dumps([ALERT]))
+    assert r.status_code == 200
+    assert r.get_json()["processed"] == 1
+
+
+def test_single_dict(client):
+    r = post(client, json.dumps(ALERT))
+    assert r.status_code == 200
+    assert r.get_json()["processed"] == 1
+
+
+def test_double_encoded_body(client):
+    # body is a JSON string that itself contains a JSON array
+    r = post(client, json.dumps(json.dumps([ALERT])))
+    assert r.status_code == 200
+    assert r.get_json()["processed"] == 1
+
+
+def test_string_element_parsed(client):
+    r = post(client, json.dumps({"alerts": [json.dumps(ALERT)]}))
+    assert r.status_code == 200
+    assert r.get_json()["processed"] == 1
+
+
+def test_unparseable_string_element_skipped(client):
+    r = post(client, json.dumps({"alerts": ["not json"]}))
+    assert r.status_code == 200
+    body = r.get_json()
+    assert body["processed"] == 0
+    assert body["skipped"] == 1
+
+
+def test_non_dict_element_skipped(client):
+    r = post(client, json.dumps({"alerts": [42]}))
+    assert r.status_code == 200
+    assert r.get_json()["skipped"] == 1
+
+
+def test_invalid_json_rejected(client):
+    r = post(client, "{not json")
+    assert r.status_code == 400
+    assert r.get_json()["error"] == "invalid_json"
+
+
+def test_overlarge_payload_truncated(client, monkeypatch):
+    monkeypatch.setattr(webhook_app, "MAX_ALERTS", 2)
+    r = post(client, json.dumps({"alerts": [ALERT] * 5}))
+    assert r.status_code == 200
+    body = r.get_json()
+    assert body["received_raw_count"] == 5
+    assert body["processed"] == 2
+    assert body["truncated"] == 3
+
+
+def test_missing_fields_defaulted(client):
+    r = post(client, json.dumps({"alerts": [{"labels": {}, "annotations": {}}]}))
+    assert r.status_code == 200
+    assert r.get_json()["processed"] == 1